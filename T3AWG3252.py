@@ -1,4 +1,8 @@
+import hashlib
+import time
+from types import MappingProxyType
 import numpy as np
+from pymeasure.adapters import VISAAdapter
 from pymeasure.instruments import Instrument
 from pymeasure.instruments.validators import strict_discrete_set,strict_range,joined_validators
 from pyvisa.errors import VisaIOError
@@ -7,6 +11,108 @@ import logging
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+# Width of the text of a float32 in its shortest round-trip form. NumPy
+# uses positional notation below 1e16, so the text is at most 19 characters
+# ('-1234567800000000.0'); one spare byte lets truncation be detected.
+_SAMPLE_WIDTH = 20
+
+# Time (s) during which a state() reply is reused, so bursts of polling
+# cost a single query
+_STATE_TTL = 0.01
+
+# Extra sample appended by upload_signal_teledyne after the signal samples.
+# It is stored in the file but not played, the sequence length excludes it.
+_END_MARKER = 100.0
+
+# Number of samples formatted at a time, so the text of a large waveform
+# is never held twice as one giant intermediate string
+_FORMAT_CHUNK = 65536
+
+def _ieee_block(command, buf):
+    """
+    Turns the payload bytes held in buf, in place, into the command followed
+    by an IEEE-488.2 definite-length block and returns buf:
+    <command> #<number of digits of the length><length><payload>
+    The number of digits is a single digit, so the payload must be
+    smaller than 10**9 bytes.
+    """
+    # The length text is built once and gives the digit count too
+    len_data = str(len(buf))
+    if len(len_data) > 9:
+        raise ValueError("The payload of {} bytes does not fit in a "
+                         "definite-length block".format(len_data))
+    buf[0:0] = '{} #{}{}'.format(command,len(len_data),len_data).encode()
+    return buf
+
+def _format_lines(samples):
+    """
+    Formats float32 samples as text lines ended by \\r\\n, without a Python
+    loop. Each value is cast to a fixed-width byte string (the shortest text
+    that reads back as the same float32), the line ending is added as two
+    extra columns and the NUL padding is dropped.
+    Returns a uint8 array with the text.
+    """
+    lines = np.empty((len(samples),_SAMPLE_WIDTH+2), dtype=np.uint8)
+    text = samples.astype('S{}'.format(_SAMPLE_WIDTH)).view(np.uint8).reshape(-1,_SAMPLE_WIDTH)
+    # The cast truncates silently, a value filling the whole width may be cut
+    if text[:,-1].any():
+        raise ValueError("A sample does not fit in {} characters".format(_SAMPLE_WIDTH-1))
+    lines[:,:_SAMPLE_WIDTH] = text
+    lines[:,_SAMPLE_WIDTH:] = np.frombuffer(b'\r\n', dtype=np.uint8)
+    return lines[lines != 0]
+
+def _format_samples(samples, end_marker=None, buf=None):
+    """
+    Formats the samples as the text file expected by the waveform import,
+    one float32 value per line. If end_marker is given it is written as an
+    extra last line, without copying the samples into a longer array.
+    The text is written from the start of buf (a new bytearray by default),
+    which is trimmed to the text length and returned. Passing the same buf
+    on every call reuses its memory instead of growing a new buffer.
+    """
+    samples = np.ascontiguousarray(samples, dtype=np.float32)
+    if samples.ndim != 1:
+        raise ValueError("samples must be a one-dimensional array, got shape {}".format(samples.shape))
+    if buf is None:
+        buf = bytearray()
+    chunks = [samples[i:i+_FORMAT_CHUNK]
+              for i in range(0, len(samples), _FORMAT_CHUNK)]
+    if end_marker is not None:
+        chunks.append(np.array([end_marker], dtype=np.float32))
+    end = 0
+    for chunk in chunks:
+        text = _format_lines(chunk)
+        buf[end:end+len(text)] = memoryview(text)
+        end += len(text)
+    # The last value is not followed by a line ending
+    del buf[max(end-2,0):]
+    return buf
+
+# Default data samples (square signal), formatted once at import
+_DEFAULT_SQUARE = np.tile([0.0,1.0],10).repeat(10)
+_DEFAULT_SQUARE_PAYLOAD = bytes(_format_samples(_DEFAULT_SQUARE))
+
+# Accepted values of the output_chnN properties
+_OUTPUT_MAP = MappingProxyType({True: 'ON', 'on': 'ON', 'ON' : 'ON', 1: 'ON',
+                                False: 'OFF', 'off': 'OFF', 'OFF': 'OFF', 0: 'OFF'})
+
+def _mapped_control(get_command, set_command, docs, values):
+    """
+    Returns an Instrument.control property with mapped values whose set
+    commands are formatted once, when the class is created, so setting
+    the property is a dictionary lookup. A value that is not mapped
+    raises KeyError.
+    """
+    control = Instrument.control(get_command, set_command, docs,
+                                 map_values=True,
+                                 values=dict(values))
+    commands = MappingProxyType({key: set_command % value for key, value in values.items()})
+    
+    def fset(self, value):
+        self.write(commands[value])
+    
+    return property(control.fget, fset, doc=docs)
+
 class T3AWG3252(Instrument):
     """ Represents the Teledyne T3AWG3252 Arbitrary Wave Generator
     
@@ -15,54 +121,181 @@ class T3AWG3252(Instrument):
     
     def __init__(self, adapter, **kwargs):
         super().__init__(adapter, "Teledyne T3AWG3252 Arbitrary Wave Generator", **kwargs)
+        # Transmit buffer reused by every upload_waveform call. Trimming it to
+        # a similar or smaller size keeps its memory, so repeated uploads of
+        # alike waveforms do not reallocate it.
+        self._tx_buf = bytearray()
+        # Content hash of the last confirmed waveform uploaded under each
+        # name, and the upload waiting for its confirmation
+        self._wf_cache = {}
+        self._wf_pending = None
+        self._idn = None
+        self._state = None
+        self._state_time = 0.0
     
-    def run(self):
-        self.write('AWGControl:RUN')
+    def invalidate_cache(self):
+        """
+        Forgets the cached state so the next state() call queries the AWG.
+        """
+        self._state = None
+    
+    def _write_raw(self, data):
+        """
+        Writes the bytes to the instrument without encoding them again.
+        VXI11Adapter provides write_raw. VISAAdapter does not, so its pyvisa
+        resource is used and the write termination is added after the data,
+        as write() would do. Other adapters only write strings, so the data
+        (ASCII text) is decoded and sent with write().
+        """
+        if hasattr(self.adapter, 'write_raw'):
+            self.adapter.write_raw(data)
+        elif isinstance(self.adapter, VISAAdapter):
+            connection = self.adapter.connection
+            connection.write_raw(b''.join((data, connection.write_termination.encode())))
+        else:
+            self.write(data.decode('ascii'))
+    
+    def _sync(self):
+        """
+        Blocks until all the pending operations of the AWG are complete.
+        """
         return self.ask("*OPC?").strip()
     
-    def stop(self):
+    def run(self, wait=False):
+        self.write('AWGControl:RUN')
+        self.invalidate_cache()
+        if wait:
+            return self._sync()
+    
+    def stop(self, wait=False):
         self.write('AWGControl:STOP')
-        return self.ask("*OPC?").strip()
+        self.invalidate_cache()
+        if wait:
+            return self._sync()
     
     def state(self):
         """
         0 indicates that the AWG has stopped.
         1 indicates that the AWG is waiting for trigger.
         2 indicates that the AWG is running.
+        The reply is reused for calls within _STATE_TTL seconds.
         """
-        return self.ask('AWGControl:RSTATe?')
+        now = time.monotonic()
+        if self._state is None or now - self._state_time >= _STATE_TTL:
+            self._state = self.ask('AWGControl:RSTATe?')
+            self._state_time = now
+        return self._state
     
     def idn(self):
-        return self.ask('*IDN?')
+        """
+        The identification does not change during a session, so it is only
+        queried once.
+        """
+        if self._idn is None:
+            self._idn = self.ask('*IDN?')
+        return self._idn
     
-    def trigger(self):
+    def trigger(self, wait=False):
         self.write('*TRG')
-        return self.ask("*OPC?").strip()
+        self.invalidate_cache()
+        if wait:
+            return self._sync()
         
-    def upload_waveform(self, arb_name, data_samples=None, folder=None):
+    def upload_waveform(self, arb_name, data_samples=None, folder=None, wait=True, end_marker=None, force=False):
         """
         Uploads an arbitrary trace into the volatile memory of the device.
         The data_samples must be given as a float signed list.
+        The samples are transferred as a text file, since the waveform list
+        imports the ANAlog waveform from a .txt file with one value per line.
+        If wait is False the import is not synchronized with *OPC?, so the
+        caller can chain it with its next commands (after a *WAI).
+        If end_marker is given it is appended to data_samples as last sample.
+        An upload whose samples, end_marker and folder match the last
+        confirmed upload of arb_name only stops the AWG, the waveform is not
+        transferred again, unless force is True. An upload is confirmed when
+        SYSTem:ERRor? reports no error once the import is complete (with
+        wait=False the caller confirms it).
+        After a reset or power cycle of the AWG, or if the waveform list is
+        changed from elsewhere, call clear_waveforms() or pass force=True.
         """
         #Steps:
-        #1) Format data samples
-        if data_samples is None: # Generate default data samples (square signal)
-            data_samples = np.repeat(np.tile([0,1]),10)
-        data_samples = '\r\n'.join([str(i) for i in data_samples])
-            
+        #1) Skip the transfer if the waveform is already in the waveform list
+        self._wf_pending = None
         if folder == None:
             folder = "C:/Users/awg3000/Pictures/Saved Pictures/"
-        len_data = str(len(data_samples))
+        default = data_samples is None
+        if default:
+            data_samples = _DEFAULT_SQUARE
+        data_samples = np.ascontiguousarray(data_samples, dtype=np.float32)
+        key = hashlib.blake2b(data_samples, digest_size=16)
+        key.update(repr((end_marker, folder)).encode())
+        key = key.digest()
+        if not force and self._wf_cache.get(arb_name) == key:
+            return self.stop(wait)
         
-        #2) Transfer the text file from the PC to the mass storage device attached to the AWG
-        self.stop()
-        self.write('MMEMory:DOWNload:FNAMe "{}{}.txt"'.format(folder,arb_name))
-        self.write('MMEMory:DOWNload:DATA #{}{}{}'.format(len(len_data),len_data,data_samples))
-        self.ask("*OPC?").strip()
-        #3) Import the waveform list
-        self.write('WLISt:WAVeform:DELete "{0}"'.format(arb_name))
-        self.write('WLISt:WAVeform:IMPort "{1}","{0}/{1}.txt",ANAlog'.format(folder,arb_name))
-        return self.ask("*OPC?").strip()
+        #2) Format data samples
+        if default and end_marker is None: # Use the default data samples (square signal)
+            self._tx_buf[:] = _DEFAULT_SQUARE_PAYLOAD
+        else:
+            _format_samples(data_samples, end_marker, self._tx_buf)
+        # The header is added once, before anything is sent, so a payload
+        # too large for the block fails without stopping the AWG
+        block = _ieee_block('MMEMory:DOWNload:DATA',self._tx_buf)
+        
+        #3) Transfer the text file from the PC to the mass storage device attached to the AWG
+        # The previous waveform of arb_name is deleted below, so it is not
+        # cached anymore until this upload is confirmed
+        self._wf_cache.pop(arb_name, None)
+        self.write('AWGControl:STOP;:MMEMory:DOWNload:FNAMe "{}{}.txt"'.format(folder,arb_name))
+        self.invalidate_cache()
+        # The block is sent as raw bytes so the payload is not copied into a
+        # formatted command string and re-encoded by the adapter.
+        # Header and payload go in a single write: on VXI-11, USBTMC and
+        # GPIB every write ends the message, and on a socket the write
+        # termination must follow the whole block.
+        self._write_raw(block)
+        #4) Import the waveform list
+        self.write('WLISt:WAVeform:DELete "{1}";'
+                   ':WLISt:WAVeform:IMPort "{1}","{0}/{1}.txt",ANAlog'.format(folder,arb_name))
+        self._wf_pending = (arb_name, key)
+        if wait:
+            reply = self._sync()
+            self._confirm_upload()
+            return reply
+    
+    def _confirm_upload(self):
+        """
+        Caches the waveform of the last upload_waveform call if SYSTem:ERRor?
+        reports no error. Call it once the import is complete (after *OPC?).
+        An error left in the queue by an earlier command also prevents the
+        caching, so the next upload is transferred again.
+        """
+        pending, self._wf_pending = self._wf_pending, None
+        if pending is None:
+            return
+        arb_name, key = pending
+        error = self.ask('SYSTem:ERRor?').strip()
+        try:
+            code = int(error.split(',')[0])
+        except ValueError:
+            code = None
+        if code == 0:
+            self._wf_cache[arb_name] = key
+        else:
+            log.warning("Waveform %s is not cached, the AWG reported: %s", arb_name, error)
+    
+    def clear_waveforms(self):
+        """
+        Deletes the waveforms uploaded with upload_waveform from the waveform
+        list, so the next upload of any of them is transferred again.
+        Call it after the AWG is reset or power cycled, since its volatile
+        waveform list no longer holds them.
+        """
+        if self._wf_cache:
+            self.write(';:'.join('WLISt:WAVeform:DELete "{}"'.format(arb_name)
+                                 for arb_name in self._wf_cache))
+        self._wf_cache.clear()
+        self._wf_pending = None
     
     # System properties
     run_mode = Instrument.control(
@@ -118,123 +351,20 @@ class T3AWG3252(Instrument):
         validator = strict_discrete_set,
         values = ["AMPL","HIGH"]
     )
-        
-    output_chn1 = Instrument.control(
-        get_command="OUTPut1:STATe?",
-        set_command="OUTPut1:STATe %s",
-        docs=""" A boolean property that turns on (True, 'on') or off (False, 'off')
-        the output of the function generator. Can be set. """,
-        validator=strict_discrete_set,
-        map_values=True,
-        values={True: 'ON', 'on': 'ON', 'ON' : 'ON', 1: 'ON',
-                False: 'OFF', 'off': 'OFF', 'OFF': 'OFF', 0: 'OFF'}
-    )
-    
-    output_load_chn1 = Instrument.control(
-        "OUTPut1:SERIESIMPedance?", "OUTPut1:SERIESIMPedance %s",
-        """ Sets the expected load resistance (should be the load impedance connected
-        to the output. The output impedance is always 50 Ohm, this setting can be used
-        to correct the displayed voltage for loads unmatched to 50 Ohm.
-        Valid values are 50Ohm or 5Ohm.
-        No validator is used since both numeric and string inputs are accepted,
-        thus a value outside the range will not return an error.
-        Can be set. """,
-        validator=strict_discrete_set,
-        values=['50Ohm','LOW']
-    )
-    
-    voltage_high_chn1 = Instrument.control(
-        "SEQuence:ELEM1:VOLTage:HIGH1?", "SEQuence:ELEM1:VOLTage:HIGH1 %s",
-        """ A floating point property that controls the upper voltage of the
-        output waveform in V, from -3 V to 3 V (must be higher than low
-        voltage by at least 1 mV). Can be set. """,
-        validator=strict_range,
-        values=[-3, 3],
-    )
-    
-    voltage_low_chn1 = Instrument.control(
-        "SEQuence:ELEM1:VOLTage:LOW1?", "SEQuence:ELEM1:VOLTage:LOW1 %s",
-        """ A floating point property that controls the upper voltage of the
-        output waveform in V, from -3 V to 3 V (must be higher than low
-        voltage by at least 1 mV). Can be set. """,
-        validator=strict_range,
-        values=[-3, 3],
-    )
-    
-    amplitude_chn1 = Instrument.control(
-        "SEQuence:ELEM1:AMPlitude1?", "SEQuence:ELEM1:AMPlitude1 %s",
-        """ Sets or returns the voltage peak-to-peak amplitude for the element
-        “n=1” of the channel “m=1”.
-        
-        Apart from the amplitude in volts it can also accept the following values:
-        if MINimum sets or queries the minimum amplitude level.
-        if MAXimum sets or queries the maximum amplitude level.
-        if DEFault sets the default amplitude level (2V).
-        """,
-    )
-    
-    offset_chn1 = Instrument.control(
-        "SEQuence:ELEM1:OFFset1?", "SEQuence:ELEM1:OFFset1 %s",
-        """ Sets or returns the voltage offset for the element
-        “n=1” of the channel “m=1”.
-        
-        Apart from the offset in volts it can also accept the following values:
-        MINimum sets or queries the minimum offset level.
-        MAXimum sets or queries the maximum offset level.
-        DEFault sets the default offset level (0V).
-        """,
-    )
-    
-    length_chn1 = Instrument.control(
-        "SEQuence:ELEM1:LENGth?", "SEQuence:ELEM1:LENGth %s",
-        """ Sets or returns the number of samples of the waveform
-        for the element “n”.
-        Apart from the length it can also accept the following values:
-        MINimum sets or queries the minimum value of length.
-        MAXimum sets or queries the maximum value of length.
-        DEFault sets the default value of length (2048).
-        """,
-    )
-    
-    loop_count_chn1 = Instrument.control(
-        "SEQuence:ELEM1:LOOP:COUNt?", "SEQuence:ELEM1:LOOP:COUNt %s",
-        """ Sets or returns the number of samples of the waveform
-        for the element “n”.
-        Apart from the loop count it can also accept the following values:
-        MINimum sets or queries the minimum value of repetitons parameter.
-        MAXimum sets or queries the maximum value of repetitons
-        parameter.
-        INFinite sets infinite repetitons.
-        DEFault sets the default value of repetition (1).
-        """,
-    )
-    
-    waveform_chn1 = Instrument.control(
-        "SEQuence:ELEM1:WAVeform1?",
-        "SEQuence:ELEM1:WAVeform1 \"%s\"",
-        """This command sets or returns the waveform for the sequence
-        element n=1. The value of m=1 indicates the channel that will output
-        the waveform when the sequence is run. It’s possible select a
-        waveform only from those in the waveform list. In waveform list are
-        already present 10 predefined waveform: Sine, Ramp, Square, Sync,
-        DC, Gaussian, Lorentz, Haversine, Exp_Rise and Exp_Decay but user
-        can import in the list others customized waveforms.
-        """,
-    )
     
-    output_chn2 = Instrument.control(
-        get_command="OUTPut2:STATe?",
-        set_command="OUTPut2:STATe %s",
+# Channel properties. Both channels share the same commands, so each
+# property is generated from one template instead of being written twice.
+for _ch in (1,2):
+    setattr(T3AWG3252, 'output_chn{}'.format(_ch), _mapped_control(
+        get_command="OUTPut{}:STATe?".format(_ch),
+        set_command="OUTPut{}:STATe %s".format(_ch),
         docs=""" A boolean property that turns on (True, 'on') or off (False, 'off')
         the output of the function generator. Can be set. """,
-        validator=strict_discrete_set,
-        map_values=True,
-        values={True: 'ON', 'on': 'ON', 'ON' : 'ON', 1: 'ON',
-                False: 'OFF', 'off': 'OFF', 'OFF': 'OFF', 0: 'OFF'}
-    )
+        values=_OUTPUT_MAP
+    ))
     
-    output_load_chn2 = Instrument.control(
-        "OUTPut2:SERIESIMPedance?", "OUTPut2:SERIESIMPedance %s",
+    setattr(T3AWG3252, 'output_load_chn{}'.format(_ch), Instrument.control(
+        "OUTPut{0}:SERIESIMPedance?".format(_ch), "OUTPut{0}:SERIESIMPedance %s".format(_ch),
         """ Sets the expected load resistance (should be the load impedance connected
         to the output. The output impedance is always 50 Ohm, this setting can be used
         to correct the displayed voltage for loads unmatched to 50 Ohm.
@@ -244,51 +374,51 @@ class T3AWG3252(Instrument):
         Can be set. """,
         validator=strict_discrete_set,
         values=['50Ohm','LOW']
-    )
+    ))
     
-    voltage_high_chn2 = Instrument.control(
-        "SEQuence:ELEM1:VOLTage:HIGH2?", "SEQuence:ELEM1:VOLTage:HIGH2 %s",
+    setattr(T3AWG3252, 'voltage_high_chn{}'.format(_ch), Instrument.control(
+        "SEQuence:ELEM1:VOLTage:HIGH{0}?".format(_ch), "SEQuence:ELEM1:VOLTage:HIGH{0} %s".format(_ch),
         """ A floating point property that controls the upper voltage of the
         output waveform in V, from -3 V to 3 V (must be higher than low
         voltage by at least 1 mV). Can be set. """,
         validator=strict_range,
         values=[-3, 3],
-    )
+    ))
     
-    voltage_low_chn2 = Instrument.control(
-        "SEQuence:ELEM1:VOLTage:LOW2?", "SEQuence:ELEM1:VOLTage:LOWyyy %s",
-        """ A floating point property that controls the upper voltage of the
-        output waveform in V, from -3 V to 3 V (must be higher than low
+    setattr(T3AWG3252, 'voltage_low_chn{}'.format(_ch), Instrument.control(
+        "SEQuence:ELEM1:VOLTage:LOW{0}?".format(_ch), "SEQuence:ELEM1:VOLTage:LOW{0} %s".format(_ch),
+        """ A floating point property that controls the lower voltage of the
+        output waveform in V, from -3 V to 3 V (must be lower than high
         voltage by at least 1 mV). Can be set. """,
         validator=strict_range,
         values=[-3, 3],
-    )
+    ))
     
-    amplitude_chn2 = Instrument.control(
-        "SEQuence:ELEM1:AMPlitude2?", "SEQuence:ELEM1:AMPlitude2 %s",
+    setattr(T3AWG3252, 'amplitude_chn{}'.format(_ch), Instrument.control(
+        "SEQuence:ELEM1:AMPlitude{0}?".format(_ch), "SEQuence:ELEM1:AMPlitude{0} %s".format(_ch),
         """ Sets or returns the voltage peak-to-peak amplitude for the element
-        “n=1” of the channel “m=2”.
+        “n=1” of the channel “m={0}”.
         
         Apart from the amplitude in volts it can also accept the following values:
         if MINimum sets or queries the minimum amplitude level.
         if MAXimum sets or queries the maximum amplitude level.
         if DEFault sets the default amplitude level (2V).
-        """,
-    )
+        """.format(_ch),
+    ))
     
-    offset_chn2 = Instrument.control(
-        "SEQuence:ELEM1:OFFset2?", "SEQuence:ELEM1:OFFset2 %s",
+    setattr(T3AWG3252, 'offset_chn{}'.format(_ch), Instrument.control(
+        "SEQuence:ELEM1:OFFset{0}?".format(_ch), "SEQuence:ELEM1:OFFset{0} %s".format(_ch),
         """ Sets or returns the voltage offset for the element
-        “n=1” of the channel “m=2”.
+        “n=1” of the channel “m={0}”.
         
         Apart from the offset in volts it can also accept the following values:
         MINimum sets or queries the minimum offset level.
         MAXimum sets or queries the maximum offset level.
         DEFault sets the default offset level (0V).
-        """,
-    )
+        """.format(_ch),
+    ))
     
-    length_chn2 = Instrument.control(
+    setattr(T3AWG3252, 'length_chn{}'.format(_ch), Instrument.control(
         "SEQuence:ELEM1:LENGth?", "SEQuence:ELEM1:LENGth %s",
         """ Sets or returns the number of samples of the waveform
         for the element “n”.
@@ -297,9 +427,9 @@ class T3AWG3252(Instrument):
         MAXimum sets or queries the maximum value of length.
         DEFault sets the default value of length (2048).
         """,
-    )
+    ))
     
-    loop_count_chn2 = Instrument.control(
+    setattr(T3AWG3252, 'loop_count_chn{}'.format(_ch), Instrument.control(
         "SEQuence:ELEM1:LOOP:COUNt?", "SEQuence:ELEM1:LOOP:COUNt %s",
         """ Sets or returns the number of samples of the waveform
         for the element “n”.
@@ -310,20 +440,33 @@ class T3AWG3252(Instrument):
         INFinite sets infinite repetitons.
         DEFault sets the default value of repetition (1).
         """,
-    )
+    ))
     
-    waveform_chn2 = Instrument.control(
-        "SEQuence:ELEM1:WAVeform2?",
-        "SEQuence:ELEM1:WAVeform2 \"%s\"",
+    setattr(T3AWG3252, 'waveform_chn{}'.format(_ch), Instrument.control(
+        "SEQuence:ELEM1:WAVeform{0}?".format(_ch),
+        "SEQuence:ELEM1:WAVeform{0} \"%s\"".format(_ch),
         """This command sets or returns the waveform for the sequence
-        element n=1. The value of m=2 indicates the channel that will output
+        element n=1. The value of m={0} indicates the channel that will output
         the waveform when the sequence is run. It’s possible select a
         waveform only from those in the waveform list. In waveform list are
         already present 10 predefined waveform: Sine, Ramp, Square, Sync,
         DC, Gaussian, Lorentz, Haversine, Exp_Rise and Exp_Decay but user
         can import in the list others customized waveforms.
-        """,
-    )
+        """.format(_ch),
+    ))
+del _ch
+
+# Chained command used by upload_signal_teledyne to configure each channel,
+# with the channel number already filled in.
+# The remaining fields are the high voltage, the waveform name and the length.
+_CHANNEL_SETUP = {ch: ('OUTPut{0}:STATe OFF;'
+                       ':OUTPut{0}:SERIESIMPedance 50Ohm;'
+                       ':SEQuence:ELEM1:VOLTage:HIGH{0} %s;'
+                       ':SEQuence:ELEM1:VOLTage:LOW{0} 0;'
+                       ':SEQuence:ELEM1:WAVeform{0} "%s";'
+                       ':SEQuence:ELEM1:LENGth %s;'
+                       ':OUTPut{0}:STATe ON').format(ch)
+                  for ch in (1,2)}
     
 def upload_signal_teledyne(awg,
                            name,
@@ -331,41 +474,47 @@ def upload_signal_teledyne(awg,
                            amp,
                            fs=None, # The sample rate is the same for both channels
                            channel=1,
-                           run=False #If True the AWG will automatically run
+                           run=False, #If True the AWG will automatically run
+                           force=False #If True the waveform is uploaded even if unchanged
                           ):
     """
     Uploads the signal to the Teledyne AWG.
     This are the followed steps.
-    1) Disable the channel output. 
-    2) Configure the channel.
-    3) Upload waveform
+    1) Stop the AWG and upload waveform.
+    2) Disable the channel output.
+    3) Configure the channel.
     4) Selects waveform for channel
     5) Enable the channel output.
     
     Args:
         awg: The awg object.
         name (string): Name of the waveform. Recomended "temp1" for channel 1 and "temp2" for channel 2.
-        samples (numpy array of floats): The samples of the signal.
+        samples (numpy array of floats): The samples of the signal, sent as float32.
         amp (float): The amplitude of the signal. Values selected are [-3,3]V
         fs (float): Sampling frequency (Hz). The number of samples per second.
         channel (int): Selected channel.
         run (Boolean): Run.
+        force (Boolean): Upload the waveform even if the last confirmed upload
+            of name had the same samples.
     """
-    samples = np.concatenate([samples,[100]])
-    awg.stop()
-    awg.display_unit_volt = 'HIGH'
-    awg.upload_waveform(name,samples,None)
+    # Converted once so every later stage works on float32 without copying
+    samples = np.ascontiguousarray(samples, dtype=np.float32)
+    amp = strict_range(amp,[-3,3])
+    if str(channel) not in ('1','2'):
+        raise ValueError("Channel {} is not available, use 1 or 2".format(channel))
+    setup = _CHANNEL_SETUP[int(channel)] % (amp,name,len(samples))
+    awg.upload_waveform(name,samples,None,wait=False,end_marker=_END_MARKER,force=force)
     
+    # Everything after the upload is sent as one compound command answered
+    # by a single *OPC?. The *WAI makes the AWG finish the waveform import
+    # before the channel selects it.
+    commands = ['*WAI', ':DISPlay:UNIT:VOLT HIGH']
     if fs is not None:
-        awg.arb_srate=fs
-    
-    setattr(awg,'output_chn{}'.format(channel),'off')
-    setattr(awg,'output_load_chn{}'.format(channel),'50Ohm')
-    setattr(awg,'voltage_high_chn{}'.format(channel),amp)
-    setattr(awg,'voltage_low_chn{}'.format(channel),0)
-    setattr(awg,'waveform_chn{}'.format(channel),name)
-    setattr(awg,'length_chn{}'.format(channel),len(samples)-1)
-    setattr(awg,'output_chn{}'.format(channel),'on')
-    
+        commands.append(':AWGControl:SRATe %f' % fs)
+    commands.append(':' + setup)
     if run:
-        awg.run()
\ No newline at end of file
+        commands.append(':AWGControl:RUN')
+    commands.append('*OPC?')
+    awg.ask(';'.join(commands))
+    awg._confirm_upload()
+    awg.invalidate_cache()
\ No newline at end of file